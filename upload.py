@@ -1,24 +1,96 @@
 import os
+import io
+import stat
+import time
 import datetime
 import argparse
+import threading
 from dotenv import load_dotenv
 from ks3.connection import Connection
+from ks3.http import KS3HTTPAdapter, KS3HTTPConnection, KS3HTTPConnectionPool
 from tqdm import tqdm
 
+# 当前线程的上传进度回调，由 sendfile 发送循环调用
+_send_progress = threading.local()
+
+
+def _is_regular_file(body):
+    if not isinstance(body, io.BufferedReader):
+        return False
+    try:
+        return stat.S_ISREG(os.fstat(body.fileno()).st_mode)
+    except (OSError, ValueError):
+        return False
+
+
+class _SendfileMixin:
+    """请求体是普通文件时，用 socket.sendfile 由内核直接从页缓存发送，省去一次用户态拷贝"""
+    sendfile_chunk = 8 * 1024 * 1024
+
+    def request(self, method, url, body=None, headers=None, **kwargs):
+        length = headers.get('Content-Length') if headers else None
+        if kwargs.get('chunked') or length is None or not _is_regular_file(body):
+            return super().request(method, url, body=body, headers=headers, **kwargs)
+
+        # 先只发送请求头（Content-Length 已由 SDK 设置），再用 sendfile 发送文件内容
+        super().request(method, url, body=None, headers=headers, **kwargs)
+        offset = body.tell()
+        count = int(length)
+        callback = getattr(_send_progress, 'callback', None)
+        sent = 0
+        while sent < count:
+            n = self.sock.sendfile(body, offset + sent, min(self.sendfile_chunk, count - sent))
+            if not n:
+                # 文件在上传过程中变短，发不满 Content-Length 会让请求一直等到读超时
+                raise IOError(f"文件内容不足：已发送 {sent} 字节，应为 {count} 字节")
+            sent += n
+            if callback:
+                callback(sent)
+
+
+class _SendfileHTTPConnection(_SendfileMixin, KS3HTTPConnection):
+    pass
+
+
+class _SendfileHTTPConnectionPool(KS3HTTPConnectionPool):
+    ConnectionCls = _SendfileHTTPConnection
+
+
+class _SendfileHTTPAdapter(KS3HTTPAdapter):
+    """只用于明文 HTTP：TLS 套接字上的 sendfile 会退回普通 send，得不到零拷贝"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _SendfileHTTPConnectionPool,
+        }
+
+
 class KS3Uploader:
     def __init__(self):
         load_dotenv()
         self._validate_config()
+        is_secure = os.getenv("KS3_USE_HTTPS", "True").lower() == "true"
         self.conn = Connection(
             os.getenv("KS3_ACCESS_KEY"),
             os.getenv("KS3_SECRET_KEY"),
             host=os.getenv("KS3_ENDPOINT"),
-            is_secure=os.getenv("KS3_USE_HTTPS", "True").lower() == "true",
+            is_secure=is_secure,
             domain_mode=False,
-            timeout=1
+            # (连接超时, 读超时)；SDK 内部的 requests.Session 会复用 keep-alive 连接
+            timeout=(10, 120),
+            connection_pool_size=1,
+            # crc64 需要在用户态读取数据计算，与 sendfile 冲突；单次 PUT 仍带 Content-MD5 由服务端校验
+            # HTTPS 下 SSLSocket.sendfile 会退回普通 send，没有零拷贝可言，因此保留 crc64 校验
+            enable_crc=is_secure
         )
+        if not is_secure:
+            adapter = _SendfileHTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=0,
+                                           block_size=self.conn.block_size)
+            self.conn.session.mount('http://', adapter)
         self.bucket_name = os.getenv("KS3_BUCKET")
         self.bucket = self.conn.get_bucket(self.bucket_name)
+        self._last_key = None
 
     def _validate_config(self):
         """检查环境变量配置"""
@@ -37,25 +109,41 @@ class KS3Uploader:
         print(f"本地路径:  {os.path.abspath(local_path)}")
         print(f"远程路径: {remote_key} ({file_size/1024/1024:.2f} MB)")
 
-        with tqdm(total=file_size, unit='B', unit_scale=True, desc="上传进度") as pbar:
+        self._last_cb_t = 0.0
+        self._last_cb_bytes = 0
+        with tqdm(total=file_size, unit='B', unit_scale=True, desc="上传进度", mininterval=0.1, maxinterval=0.5) as pbar:
             def callback(uploaded_bytes):
-                pbar.update(uploaded_bytes - pbar.n)
+                # 节流：距上次刷新超过 1 MiB 或 50 ms 才更新进度条
+                now = time.monotonic()
+                if uploaded_bytes - self._last_cb_bytes >= 1 << 20 or now - self._last_cb_t > 0.05:
+                    pbar.update(uploaded_bytes - pbar.n)
+                    self._last_cb_t = now
+                    self._last_cb_bytes = uploaded_bytes
 
+            _send_progress.callback = callback
             try:
                 key = self.bucket.new_key(remote_key)
                 key.set_contents_from_filename(local_path, cb=callback)
+                pbar.update(file_size - pbar.n)
+                self._last_key = key
                 print("\n✅ 上传成功！")
                 return f"ks3://{self.bucket_name}/{remote_key}"
             except Exception as e:
                 print(f"\n❌ 上传失败: {str(e)}")
                 return None
+            finally:
+                _send_progress.callback = None
 
-    def generate_presigned_url(self, object_key, expires_in_seconds=3600):
+    def generate_presigned_url(self, object_key, expires_in_seconds=3600, key=None):
         """
         生成预签名下载链接（默认有效期 1 小时）
+        传入 key 或刚上传过同名对象时直接用本地的 Key 签名，不再请求 KS3
         """
         try:
-            key = self.bucket.get_key(object_key)
+            if key is None and self._last_key is not None and self._last_key.name == object_key:
+                key = self._last_key
+            if key is None:
+                key = self.bucket.get_key(object_key)
             if not key:
                 print(f"❌ 文件未找到: {object_key}")
                 return None
@@ -1,28 +1,240 @@
 import os
 import io
 import json
+import mimetypes
+import array
+import math
+import mmap
+import struct
+import base64
+import hashlib
+import queue
 import datetime
 import argparse
+import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from ks3.connection import Connection
+from ks3.exception import S3ResponseError
+from ks3.key import Key
 from tqdm import tqdm
 import time
-from ks3.multipart import Part
+from ks3.multipart import Part, MultiPartUpload, PartInfo
+
+class _PartView(io.RawIOBase):
+    """分片数据的只读、可 seek 视图基类，位置相对于分片起点"""
+
+    def __init__(self, length, progress=None):
+        super().__init__()
+        self.length = length
+        self.pos = 0
+        # 可选的进度回调，每次读取后以已读字节数调用
+        self.progress = progress
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, pos, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            pos += self.pos
+        elif whence == io.SEEK_END:
+            pos += self.length
+        self.pos = max(0, min(pos, self.length))
+        return self.pos
+
+    def _remaining(self, size):
+        if size is None or size < 0:
+            size = self.length - self.pos
+        return max(0, min(size, self.length - self.pos))
+
+    def _advance(self, n):
+        self.pos += n
+        if self.progress:
+            self.progress(self.pos)
+
+
+class _PartFileView(_PartView):
+    """文件中某个分片的只读视图，发送时通过 os.pread 直接从磁盘读取，不缓存整个分片"""
+
+    def __init__(self, fd, offset, length, progress=None):
+        super().__init__(length, progress)
+        self.fd = fd
+        self.offset = offset
+
+    def read(self, size=-1):
+        size = self._remaining(size)
+        if not size:
+            return b""
+        data = os.pread(self.fd, size, self.offset + self.pos)
+        self._advance(len(data))
+        return data
+
+    def readinto(self, b):
+        size = self._remaining(len(b))
+        if not size:
+            return 0
+        if hasattr(os, 'preadv'):
+            # 直接读进调用方的缓冲区，省去中间的 bytes 对象
+            n = os.preadv(self.fd, [memoryview(b)[:size]], self.offset + self.pos)
+        else:
+            data = os.pread(self.fd, size, self.offset + self.pos)
+            n = len(data)
+            b[:n] = data
+        self._advance(n)
+        return n
+
+
+class _MemoryPartView(_PartView):
+    """包装缓冲池中已读入的分片数据，按需切片读取，不像 io.BytesIO 那样复制整个分片"""
+
+    def __init__(self, data):
+        super().__init__(len(data))
+        self.data = data
+
+    def read(self, size=-1):
+        size = self._remaining(size)
+        data = self.data[self.pos:self.pos + size].tobytes()
+        self._advance(size)
+        return data
+
+    def readinto(self, b):
+        size = self._remaining(len(b))
+        b[:size] = self.data[self.pos:self.pos + size]
+        self._advance(size)
+        return size
+
+
+MiB = 1024 * 1024
+# 分片日志的定长记录：part_num(uint32) + etag(32 字节十六进制) + size(uint64) + crc64(uint64)，共 52 字节
+# crc64 为 0 表示服务端未返回该分片的 crc
+_PART_RECORD = struct.Struct('<I32sQQ')
+
+
+def _choose_part_size(file_size):
+    """按文件大小自适应分片：约 1000 个分片，限定在 5 MiB ~ 5 GiB 之间并按 MiB 向上取整"""
+    part_size = max(5 * MiB, min(5 * 1024 * MiB, math.ceil(file_size / 1000)))
+    return (part_size + MiB - 1) // MiB * MiB
+
+
+def _fadvise(fd, offset, length, advice):
+    """向内核提示文件访问模式；posix_fadvise 仅在 Linux 等平台可用，其他平台直接忽略"""
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, offset, length, getattr(os, advice))
+
+
+def _md5_pair(h):
+    return h.hexdigest(), base64.b64encode(h.digest()).decode()
+
+
+class _Prefetcher(threading.Thread):
+    """后台预读线程：上传进行时提前把后续分片读入页缓存，使磁盘读取与网络发送重叠"""
+
+    def __init__(self, local_path, ranges, depth):
+        super().__init__(daemon=True)
+        self.local_path = local_path
+        self.ranges = ranges
+        self._slots = threading.Semaphore(depth)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        buf = memoryview(bytearray(1 << 20))
+        with open(self.local_path, 'rb', buffering=0) as f:
+            for offset, length in self.ranges:
+                self._slots.acquire()
+                if self._stop_event.is_set():
+                    return
+                if hasattr(os, 'posix_fadvise'):
+                    # 由内核异步预读，无需在用户态拷贝数据
+                    _fadvise(f.fileno(), offset, length, 'POSIX_FADV_WILLNEED')
+                    continue
+                f.seek(offset)
+                while length > 0 and not self._stop_event.is_set():
+                    n = f.readinto(buf[:min(len(buf), length)])
+                    if not n:
+                        break
+                    length -= n
+
+    def advance(self):
+        """一个分片上传完成，允许再向前预读一个分片"""
+        self._slots.release()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop_event.set()
+        self._slots.release()
+
+
+# 存活的上传器实例（弱引用，不影响回收）
+_uploaders = weakref.WeakSet()
+
+
+def _reset_connections_after_fork():
+    """在 fork 出的子进程中丢弃所有线程缓存的连接，避免与父进程共用同一个 socket"""
+    for uploader in list(_uploaders):
+        uploader._tls = threading.local()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_connections_after_fork)
+
 
 class KS3Uploader:
-    def __init__(self):
+    def __init__(self, max_workers=8, prefetch_parts=2):
         load_dotenv()
         self._validate_config()
-        self.conn = Connection(
-            os.getenv("KS3_ACCESS_KEY"),
-            os.getenv("KS3_SECRET_KEY"),
-            host=os.getenv("KS3_ENDPOINT"),
-            is_secure=os.getenv("KS3_USE_HTTPS", "True").lower() == "true",
-            domain_mode=False,
-            timeout=30
-        )
+        self._access_key = os.getenv("KS3_ACCESS_KEY")
+        self._secret_key = os.getenv("KS3_SECRET_KEY")
+        self._endpoint = os.getenv("KS3_ENDPOINT")
+        self._is_secure = os.getenv("KS3_USE_HTTPS", "True").lower() == "true"
         self.bucket_name = os.getenv("KS3_BUCKET")
-        self.bucket = self.conn.get_bucket(self.bucket_name)
+        # 每个线程使用独立的 Connection/bucket；fork 出的子进程会整体换掉 _tls，见 _reset_connections_after_fork
+        self._tls = threading.local()
+        self._last_key = None
+        _uploaders.add(self)
+        self.max_workers = max_workers
+        self.prefetch_parts = prefetch_parts
+        # 最多缓存 max_workers 个分片缓冲区，上传结束后清空，见 upload_file
+        self._buf_pool = queue.LifoQueue(maxsize=max_workers)
+        self._read_lock = threading.Lock()
+        self._pending_journal = []
+        self._parts = {}
+        self._uploaded_bytes = 0
+        self._last_journal_flush = time.monotonic()
+
+    @property
+    def conn(self):
+        conn = getattr(self._tls, 'conn', None)
+        if conn is None:
+            conn = Connection(
+                self._access_key,
+                self._secret_key,
+                host=self._endpoint,
+                is_secure=self._is_secure,
+                domain_mode=False,
+                # (连接超时, 读超时)；连接由本线程独占，keep-alive 复用，避免每个分片重新握手
+                timeout=(10, 120),
+                connection_pool_size=1
+            )
+            self._tls.conn = conn
+        return conn
+
+    @property
+    def bucket(self):
+        bucket = getattr(self._tls, 'bucket', None)
+        if bucket is None:
+            bucket = self.conn.get_bucket(self.bucket_name)
+            self._tls.bucket = bucket
+        return bucket
 
     def _validate_config(self):
         required_vars = ["KS3_ACCESS_KEY", "KS3_SECRET_KEY", "KS3_ENDPOINT", "KS3_BUCKET"]
@@ -39,96 +251,388 @@ class KS3Uploader:
         print(f"本地路径:  {os.path.abspath(local_path)}")
         print(f"远程路径: {remote_key} ({file_size/1024/1024:.2f} MB)")
 
-        if file_size > 100 * 1024 * 1024:
-            return self.multipart_upload_with_resume(local_path, remote_key, file_size)
-        else:
-            with tqdm(total=file_size, unit='B', unit_scale=True, desc="上传进度") as pbar:
-                def callback(uploaded_bytes):
+        # KS3 分片最小 5 MiB，不足一个分片的小文件走单次 PUT，其余一律分片上传（可续传）
+        if file_size >= 5 * MiB:
+            try:
+                return self.multipart_upload_with_resume(local_path, remote_key, file_size)
+            finally:
+                # 分片缓冲区可达数 GiB，上传结束后不再保留
+                self._clear_buf_pool()
+
+        self._last_cb_t = 0.0
+        self._last_cb_bytes = 0
+        with tqdm(total=file_size, unit='B', unit_scale=True, desc="上传进度", mininterval=0.1, maxinterval=0.5) as pbar:
+            def callback(uploaded_bytes):
+                # 节流：距上次刷新超过 1 MiB 或 50 ms 才更新进度条
+                now = time.monotonic()
+                if uploaded_bytes - self._last_cb_bytes >= 1 << 20 or now - self._last_cb_t > 0.05:
                     pbar.update(uploaded_bytes - pbar.n)
+                    self._last_cb_t = now
+                    self._last_cb_bytes = uploaded_bytes
 
-                try:
-                    key = self.bucket.new_key(remote_key)
-                    key.set_contents_from_filename(local_path, cb=callback)
-                    print("\n✅ 上传成功！")
-                    return f"ks3://{self.bucket_name}/{remote_key}"
-                except Exception as e:
-                    print(f"\n❌ 上传失败: {str(e)}")
+            key = self.bucket.new_key(remote_key)
+            with open(local_path, 'rb') as f:
+                if not self._put_single(key, f, file_size, cb=callback):
+                    print("\n❌ 上传失败，已重试 3 次。")
                     return None
+            pbar.update(file_size - pbar.n)
+            self._last_key = key
+            print("\n✅ 上传成功！")
+            return f"ks3://{self.bucket_name}/{remote_key}"
+
+    def _put_single(self, key, f, size, cb=None):
+        """单次 PUT 上传整个文件，与分片上传共用流式读取、预先计算的 MD5 和重试策略"""
+        md5 = self._part_md5(f, 0, size)
+        headers = {'Content-Type': mimetypes.guess_type(f.name)[0] or key.DefaultContentType}
+        for attempt in range(3):
+            try:
+                if hasattr(os, 'pread'):
+                    # SDK 上传时不会调用 cb，改由请求体视图在被读取时回报进度
+                    body = io.BufferedReader(_PartFileView(f.fileno(), 0, size, progress=cb), buffer_size=1 << 20)
+                else:
+                    f.seek(0)
+                    body = f
+                key.set_contents_from_file(body, headers=headers, md5=md5, size=size)
+                return True
+            except Exception as e:
+                print(f"⚠️ 上传失败，重试 {attempt + 1}/3: {e}")
+                time.sleep(2 ** attempt)
+        return False
 
     def multipart_upload_with_resume(self, local_path, remote_key, file_size):
-        part_size = 50 * 1024 * 1024
-        part_count = (file_size + part_size - 1) // part_size
-        resume_path = f".resume_{os.path.basename(local_path)}.json"
-
-        if os.path.exists(resume_path):
-            with open(resume_path, 'r') as f:
-                resume_data = json.load(f)
-                upload_id = resume_data['upload_id']
-                uploaded_parts = {int(p['part_num']): p for p in resume_data['parts']}
-                print("🔄 检测到断点续传记录，尝试恢复...")
-        else:
-            mp = self.bucket.initiate_multipart_upload(remote_key)
-            upload_id = mp.id
-            uploaded_parts = {}
-            resume_data = {"upload_id": upload_id, "parts": []}
-            with open(resume_path, 'w') as f:
-                json.dump(resume_data, f)
+        part_size = _choose_part_size(file_size)
+        meta_path = f".resume_{os.path.basename(local_path)}.meta"
+        resume_path = f".resume_{os.path.basename(local_path)}.parts"
+        legacy_path = f".resume_{os.path.basename(local_path)}.json"
 
-        mp = self.bucket.get_all_multipart_uploads(prefix=remote_key)
-        mp = next((x for x in mp if x.id == upload_id), None)
+        if os.path.exists(legacy_path):
+            # 旧版本的整文件 JSON 续传记录无法沿用，取消其上传任务后删除
+            print("⚠️ 检测到旧版本的断点续传记录，取消对应的上传任务并重新开始。")
+            with open(legacy_path, 'r') as f:
+                upload_id = json.load(f).get('upload_id')
+            if upload_id:
+                self._abort_upload(remote_key, upload_id)
+            os.remove(legacy_path)
 
-        if not mp:
-            print("❌ 无法找到上传任务，终止续传。")
-            return None
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r') as f:
+                header = json.load(f)
+            if header.get('record_size') != _PART_RECORD.size:
+                print("⚠️ 断点续传记录格式不兼容，重新开始上传。")
+                # 先取消旧的上传任务，避免其已上传的分片残留在服务端
+                if header.get('upload_id'):
+                    self._abort_upload(header.get('remote_key', remote_key), header['upload_id'])
+                self._discard_resume(meta_path, resume_path)
 
-        parts = list(uploaded_parts.values())
+        mp = None
+        if os.path.exists(meta_path):
+            upload_id = header.get('upload_id')
+            print("🔄 检测到断点续传记录，尝试恢复...")
+            if not upload_id:
+                stale = "续传记录中没有上传任务"
+            elif header.get('remote_key', remote_key) != remote_key:
+                stale = f"续传记录对应的远程路径为 {header['remote_key']}，与本次上传不一致"
+            elif header.get('file_size', file_size) != file_size:
+                stale = "本地文件大小与续传记录不一致"
+            else:
+                stale = None
 
-        with open(local_path, 'rb') as f, tqdm(total=file_size, unit='B', unit_scale=True, desc="分片上传进度") as pbar:
-            pbar.update(sum([p['size'] for p in parts]))
-            for i in range(part_count):
-                part_num = i + 1
-                if part_num in uploaded_parts:
-                    continue
+            if stale:
+                # 旧记录已无法续传，取消对应的上传任务以免残留分片，再重新开始
+                print(f"⚠️ {stale}，放弃该记录并重新上传。")
+                if upload_id:
+                    self._abort_upload(header.get('remote_key', remote_key), upload_id)
+                self._discard_resume(meta_path, resume_path)
+            else:
+                # 直接用保存的 upload_id 还原上传任务，无需列举存储桶中的全部分片上传
+                mp = MultiPartUpload(self.bucket)
+                mp.key_name = remote_key
+                mp.id = upload_id
+                # 只取一个分片，确认服务端上的上传任务仍然存在；SDK 在非 200 响应时返回 None 而不抛异常
+                if mp.get_all_parts(max_parts=1) is None:
+                    print("⚠️ 服务端已不存在该上传任务，重新上传。")
+                    self._discard_resume(meta_path, resume_path)
+                    mp = None
 
-                offset = i * part_size
-                f.seek(offset)
-                data = f.read(min(part_size, file_size - offset))
+            if mp is not None:
+                # 续传必须沿用上次的分片划分
+                part_size = header['part_size']
+                with open(local_path, 'rb') as f:
+                    uploaded_parts = self._verify_uploaded_parts(
+                        f, self._load_journal(resume_path), part_size, file_size)
+                # 还原之前各分片的 crc64，complete_upload 才能校验整个对象
+                mp.part_crc_infos = {
+                    n: PartInfo(p['size'], str(p['crc64']))
+                    for n, p in uploaded_parts.items() if p['crc64'] is not None
+                }
 
-                for attempt in range(3):
+        if mp is None:
+            # 新建的上传任务直接使用，不需要再查询一次
+            # 与单次 PUT 一样按文件名猜测 Content-Type，分片上传的对象类型在初始化时确定
+            headers = {'Content-Type': mimetypes.guess_type(local_path)[0] or Key.DefaultContentType}
+            mp = self.bucket.initiate_multipart_upload(remote_key, headers=headers)
+            uploaded_parts = {}
+
+        if not os.path.exists(meta_path):
+            # 元信息只在新建任务时写一次，分片记录单独追加到定长二进制日志中
+            with open(meta_path, 'w') as f:
+                json.dump({"upload_id": mp.id, "remote_key": remote_key, "part_size": part_size,
+                           "file_size": file_size, "record_size": _PART_RECORD.size}, f)
+            open(resume_path, 'wb').close()
+
+        part_count = (file_size + part_size - 1) // part_size
+        # 已完成的分片统一记录在以 part_num 为键的字典里，并维护累计字节数
+        self._parts = uploaded_parts
+        self._uploaded_bytes = sum(p['size'] for p in uploaded_parts.values())
+        # 一次性算好各分片的偏移和长度，只有最后一个分片可能更短
+        offsets = array.array('q', range(0, file_size, part_size))
+        lengths = array.array('q', [part_size]) * part_count
+        lengths[-1] = file_size - offsets[-1]
+        pending = [
+            (part_num, offset, length)
+            for part_num, (offset, length) in enumerate(zip(offsets, lengths), 1)
+            if part_num not in self._parts
+        ]
+
+        lock = threading.Lock()
+        # 并发数随分片数增长，最多 max_workers 个线程
+        workers = max(1, min(self.max_workers, len(pending)))
+        aborted = False
+
+        with open(local_path, 'rb') as f, open(resume_path, 'ab') as journal, \
+                tqdm(total=file_size, unit='B', unit_scale=True, desc="分片上传进度",
+                     mininterval=0.1, maxinterval=0.5) as pbar, \
+                _Prefetcher(local_path, [(o, l) for _, o, l in pending], workers + self.prefetch_parts) as prefetcher, \
+                ThreadPoolExecutor(max_workers=workers) as executor:
+            pbar.update(self._uploaded_bytes)
+            _fadvise(f.fileno(), 0, file_size, 'POSIX_FADV_SEQUENTIAL')
+            futures = {
+                executor.submit(self._upload_one_part, mp, f, part_num, offset, length): part_num
+                for part_num, offset, length in pending
+            }
+            def record(part_info):
+                with lock:
+                    self._parts[part_info['part_num']] = part_info
+                    self._uploaded_bytes += part_info['size']
+                    self._append_journal(journal, part_info)
+                pbar.update(part_info['size'])
+
+            try:
+                for future in as_completed(futures):
+                    part_num = futures[future]
                     try:
-                        part = mp.upload_part_from_file(io.BytesIO(data), part_num=part_num)
-                        etag = part.headers.get('ETag', '').strip('"')
-                        parts.append({
-                            "part_num": part_num,
-                            "etag": etag,
-                            "size": len(data)
-                        })
-                        resume_data['parts'].append({
-                            "part_num": part_num,
-                            "etag": etag,
-                            "size": len(data)
-                        })
-                        with open(resume_path, 'w') as f_resume:
-                            json.dump(resume_data, f_resume)
-                        pbar.update(len(data))
+                        part_info = future.result()
+                    except Exception:
+                        print(f"❌ 分片 {part_num} 连续重试失败，取消上传任务。")
+                        executor.shutdown(wait=True, cancel_futures=True)
+                        self._abort_upload(remote_key, mp.id)
+                        aborted = True
                         break
-                    except Exception as e:
-                        print(f"⚠️ 分片 {part_num} 上传失败，重试 {attempt + 1}/3: {e}")
-                        time.sleep(2 ** attempt)
-                else:
-                    print(f"❌ 分片 {part_num} 连续重试失败，取消上传任务。")
-                    mp.cancel_upload()
-                    return None
 
+                    record(part_info)
+                    # 已上传的分片不会再读，及时从页缓存中释放，避免大文件挤占内存
+                    _fadvise(f.fileno(), offsets[part_num - 1], lengths[part_num - 1], 'POSIX_FADV_DONTNEED')
+                    prefetcher.advance()
+            except BaseException:
+                # 被中断（如 Ctrl-C）时取消排队中的分片，等传输中的分片结束后把成功的也记入日志再抛出
+                executor.shutdown(wait=True, cancel_futures=True)
+                for future, part_num in futures.items():
+                    if part_num not in self._parts and future.done() and not future.cancelled() \
+                            and future.exception() is None:
+                        record(future.result())
+                raise
+            finally:
+                # 正常结束或被中断时都把尚未落盘的记录写入日志
+                with lock:
+                    self._flush_journal(journal)
+
+        if aborted:
+            # 任务已取消，续传记录随之作废；须在日志文件关闭后再删除（Windows 不能删除打开中的文件）
+            self._discard_resume(meta_path, resume_path)
+            return None
+
+        # 只要有分片缺少 crc64 就无法拼出整个对象的 crc，此时不做整体校验，以免误判合并失败
+        crc_complete = all(p['crc64'] is not None for p in self._parts.values())
+        if not crc_complete:
+            mp.part_crc_infos = {}
         mp.complete_upload()
+        # 合并完成后直接在本地构造 Key，生成下载链接时不必再查询
+        self._last_key = self.bucket.new_key(remote_key)
 
         os.remove(resume_path)
+        os.remove(meta_path)
         print("\n✅ 分片上传成功！")
         return f"ks3://{self.bucket_name}/{remote_key}"
 
-    def generate_presigned_url(self, object_key, expires_in_seconds=3600):
+    def _upload_one_part(self, mp, f, part_num, offset, length):
+        """在工作线程中上传单个分片，通过 pread 按偏移读取，多个线程可共享同一个文件句柄"""
+        buf = None
+        try:
+            if not hasattr(os, 'pread'):
+                # 没有 pread（如 Windows）时退回到整片读入内存，缓冲区从池中复用
+                buf = self._get_buf(length)
+                with self._read_lock:
+                    f.seek(offset)
+                    n = f.readinto(memoryview(buf)[:length])
+                data = memoryview(buf)[:n]
+                md5 = _md5_pair(hashlib.md5(data))
+            else:
+                md5 = self._part_md5(f, offset, length)
+
+            # 用本线程的 bucket 构造上传对象，使分片请求走本线程自己的连接
+            worker_mp = MultiPartUpload(self.bucket)
+            worker_mp.key_name = mp.key_name
+            worker_mp.id = mp.id
+
+            for attempt in range(3):
+                try:
+                    if buf is None:
+                        body = io.BufferedReader(_PartFileView(f.fileno(), offset, length), buffer_size=1 << 20)
+                    else:
+                        body = _MemoryPartView(data)
+                    # 传入预先算好的 MD5，SDK 不必再读一遍分片，并以 Content-MD5 交由服务端校验
+                    part = worker_mp.upload_part_from_file(body, part_num=part_num, md5=md5, size=length)
+                    # complete_upload 时由主上传对象汇总各分片的 crc64 做整体校验
+                    mp.part_crc_infos.update(worker_mp.part_crc_infos)
+                    etag = part.headers.get('ETag', '').strip('"')
+                    crc_info = worker_mp.part_crc_infos.get(part_num)
+                    return {
+                        "part_num": part_num,
+                        "etag": etag,
+                        "size": length,
+                        "crc64": int(crc_info.part_crc) if crc_info and crc_info.part_crc else None
+                    }
+                except Exception as e:
+                    print(f"⚠️ 分片 {part_num} 上传失败，重试 {attempt + 1}/3: {e}")
+                    time.sleep(2 ** attempt)
+            raise RuntimeError(f"分片 {part_num} 上传失败")
+        finally:
+            if buf is not None:
+                self._put_buf(buf)
+
+    def _part_md5(self, f, offset, length):
+        """分块计算本地分片的 MD5，返回 SDK 需要的 (hex, base64) 二元组"""
+        h = hashlib.md5()
+        if hasattr(os, 'pread'):
+            body = _PartFileView(f.fileno(), offset, length)
+            buf = memoryview(bytearray(1 << 20))
+            n = body.readinto(buf)
+            while n:
+                h.update(buf[:n])
+                n = body.readinto(buf)
+        else:
+            buf = self._get_buf(length)
+            try:
+                with self._read_lock:
+                    f.seek(offset)
+                    n = f.readinto(memoryview(buf)[:length])
+                h.update(memoryview(buf)[:n])
+            finally:
+                self._put_buf(buf)
+        return _md5_pair(h)
+
+    def _verify_uploaded_parts(self, f, uploaded_parts, part_size, file_size):
+        """续传前用本地数据的 MD5 核对已上传分片的 ETag，本地文件被改动过的分片重新上传；各分片并行校验"""
+        def check(part_num, p):
+            offset = (part_num - 1) * part_size
+            length = min(part_size, file_size - offset)
+            return length > 0 and p['size'] == length and self._part_md5(f, offset, length)[0] == p['etag']
+
+        verified = {}
+        if not uploaded_parts:
+            return verified
+        # hashlib 计算 MD5 时会释放 GIL，多线程可以同时校验多个分片
+        with tqdm(total=sum(p['size'] for p in uploaded_parts.values()), unit='B', unit_scale=True,
+                  desc="校验已上传分片", mininterval=0.1, maxinterval=0.5) as pbar, \
+                ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(check, part_num, p): part_num for part_num, p in uploaded_parts.items()}
+            for future in as_completed(futures):
+                part_num = futures[future]
+                if future.result():
+                    verified[part_num] = uploaded_parts[part_num]
+                else:
+                    print(f"⚠️ 分片 {part_num} 的本地数据与上传记录不一致，将重新上传")
+                pbar.update(uploaded_parts[part_num]['size'])
+        return verified
+
+    def _abort_upload(self, remote_key, upload_id):
+        """取消服务端的分片上传任务，任务已不存在（404）时忽略"""
+        try:
+            self.bucket.cancel_multipart_upload(remote_key, upload_id)
+        except S3ResponseError as e:
+            if e.status != 404:
+                raise
+
+    def _discard_resume(self, meta_path, resume_path):
+        """删除续传元信息和分片日志"""
+        for path in (meta_path, resume_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _get_buf(self, size):
+        """从缓冲池取一个至少 size 字节的 bytearray，池为空时才新分配"""
+        try:
+            buf = self._buf_pool.get_nowait()
+            if len(buf) >= size:
+                return buf
+        except queue.Empty:
+            pass
+        return bytearray(size)
+
+    def _put_buf(self, buf):
+        try:
+            self._buf_pool.put_nowait(buf)
+        except queue.Full:
+            pass
+
+    def _clear_buf_pool(self):
+        while True:
+            try:
+                self._buf_pool.get_nowait()
+            except queue.Empty:
+                return
+
+    def _append_journal(self, journal, part_info):
+        """分组提交：攒够 8 条或距上次落盘超过 2 秒才写入并 fsync，崩溃时最多重传这几个分片"""
+        self._pending_journal.append(_PART_RECORD.pack(
+            part_info['part_num'], part_info['etag'].encode(), part_info['size'], part_info['crc64'] or 0))
+        if len(self._pending_journal) >= 8 or time.monotonic() - self._last_journal_flush > 2:
+            self._flush_journal(journal)
+
+    def _flush_journal(self, journal):
+        if self._pending_journal:
+            journal.write(b"".join(self._pending_journal))
+            journal.flush()
+            os.fsync(journal.fileno())
+            self._pending_journal.clear()
+        self._last_journal_flush = time.monotonic()
+
+    def _load_journal(self, resume_path):
+        """用 mmap 读取定长二进制分片日志，末尾不完整的记录（进程中断时写了一半）会被截掉"""
+        uploaded_parts = {}
+        if not os.path.exists(resume_path):
+            return uploaded_parts
+        size = os.path.getsize(resume_path)
+        valid_size = size - size % _PART_RECORD.size
+        if valid_size:
+            with open(resume_path, 'rb') as f, mmap.mmap(f.fileno(), valid_size, access=mmap.ACCESS_READ) as mm:
+                for part_num, etag, part_size, crc64 in _PART_RECORD.iter_unpack(mm):
+                    uploaded_parts[part_num] = {
+                        "part_num": part_num,
+                        "etag": etag.rstrip(b"\0").decode(),
+                        "size": part_size,
+                        "crc64": crc64 or None
+                    }
+        if valid_size != size:
+            os.truncate(resume_path, valid_size)
+        return uploaded_parts
+
+    def generate_presigned_url(self, object_key, expires_in_seconds=3600, key=None):
         try:
-            key = self.bucket.get_key(object_key)
+            if key is None and self._last_key is not None and self._last_key.name == object_key:
+                key = self._last_key
+            if key is None:
+                key = self.bucket.get_key(object_key)
             if not key:
                 print(f"❌ 文件未找到: {object_key}")
                 return None
@@ -142,10 +646,11 @@ def main():
     parser = argparse.ArgumentParser(description="上传文件至金山云 KS3", formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument("local_file", help="待上传的本地文件路径")
     parser.add_argument("ks3_path", help="KS3 中的目标路径（例如 'backups/test.zip'）")
+    parser.add_argument("--workers", type=int, default=8, help="分片上传的最大并发线程数")
     args = parser.parse_args()
 
     try:
-        uploader = KS3Uploader()
+        uploader = KS3Uploader(max_workers=args.workers)
         result = uploader.upload_file(args.local_file, args.ks3_path)
         if result:
             print("KS3 URI:", result)